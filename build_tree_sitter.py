@@ -1,17 +1,52 @@
+import io
 import os
+import math
+import tokenize
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from tree_sitter import Language, Parser
 import tree_sitter_python
 
 PY_LANGUAGE = Language(tree_sitter_python.language())
 
-parser = Parser()
-parser.language = PY_LANGUAGE
+# tree-sitter parsers are not thread-safe, so each thread gets its own
+_thread_local = threading.local()
 
+# Upper bound on the number of files a worker reads and parses per task
+BATCH_SIZE = 64
 
-def parse_code(code: str, file_path: str, codebase_modules=None) -> dict:
+# Repos with fewer python files than this are parsed serially; a worker pool
+# costs more to start than it saves on them
+SERIAL_THRESHOLD = 32
+
+# Python files larger than this (in bytes) are almost always generated and are skipped
+MAX_FILE_SIZE = 2_000_000
+
+
+def _get_parser() -> Parser:
+    """Return the tree-sitter parser for the current thread."""
+    parser = getattr(_thread_local, "parser", None)
+    if parser is None:
+        parser = Parser()
+        parser.language = PY_LANGUAGE
+        _thread_local.parser = parser
+    return parser
+
+
+def parse_code(code: str | bytes, file_path: str, codebase_modules=None) -> dict:
     """Parse code and extract classes, functions, relationships, line numbers, import types, and function calls."""
-    tree = parser.parse(bytes(code, "utf8"))
-    root_node = tree.root_node
+    if isinstance(code, bytes):
+        # honour a PEP 263 coding cookie / BOM
+        encoding, _ = tokenize.detect_encoding(io.BytesIO(code).readline)
+        source_bytes = code
+        code = source_bytes.decode(encoding)
+        if encoding not in ("utf-8", "utf-8-sig"):
+            # tree-sitter reads utf-8, so re-encode e.g. latin-1 sources
+            source_bytes = code.encode("utf-8")
+    else:
+        source_bytes = code.encode("utf-8")
+    tree = _get_parser().parse(source_bytes)
 
     result = {
         "file": file_path,
@@ -23,111 +58,222 @@ def parse_code(code: str, file_path: str, codebase_modules=None) -> dict:
     }
 
     def get_text(node):
-        return code[node.start_byte:node.end_byte]
+        # start_byte/end_byte are offsets into the utf-8 buffer, not into code
+        return source_bytes[node.start_byte:node.end_byte].decode("utf-8")
 
     def get_lines(node):
         return (node.start_point[0] + 1, node.end_point[0] + 1)
 
     def classify_import(import_text):
-        # Simple heuristic: check if import is from codebase modules
+        # Simple heuristic: check if the top-level imported module is a codebase module
         if codebase_modules:
-            for mod in codebase_modules:
-                if import_text.startswith(f"import {mod}") or import_text.startswith(f"from {mod}"):
+            parts = import_text.split(maxsplit=2)
+            if len(parts) > 1 and parts[0] in ("import", "from"):
+                if parts[1].split(",")[0].split(".")[0] in codebase_modules:
                     return "internal"
         # You can add more logic for standard library or third-party detection
         return "external"
 
-    def walk(node, parent_class=None):
-        if node.type == "import_statement":
-            import_text = get_text(node)
-            import_type = classify_import(import_text)
-            result["imports"].append({
-                "text": import_text,
-                "lines": get_lines(node),
-                "type": import_type
-            })
+    imports = result["imports"]
+    classes = result["classes"]
+    functions = result["functions"]
+    function_calls = result["function_calls"]
 
-        elif node.type == "class_definition":
-            class_name = get_text(node.child_by_field_name("name"))
-            start_line, end_line = get_lines(node)
-            result["classes"][class_name] = {
-                "methods": {},
-                "inherits": [],
-                "lines": (start_line, end_line)
-            }
-            bases = node.child_by_field_name("superclasses")
-            if bases:
-                result["classes"][class_name]["inherits"] = [
-                    get_text(c) for c in bases.children if c.type == "identifier"
-                ]
-            for child in node.children:
-                walk(child, parent_class=class_name)
-
-        elif node.type == "function_definition":
-            func_name = get_text(node.child_by_field_name("name"))
-            params = node.child_by_field_name("parameters")
+    # Node handlers return (descend, class name for the children)
+    def handle_import(node, parent_class):
+        import_text = get_text(node)
+        import_type = classify_import(import_text)
+        imports.append({
+            "text": import_text,
+            "lines": get_lines(node),
+            "type": import_type
+        })
+        return False, parent_class
+
+    def handle_class(node, parent_class):
+        class_name = get_text(node.child_by_field_name("name"))
+        start_line, end_line = get_lines(node)
+        class_info = {
+            "methods": {},
+            "inherits": [],
+            "lines": (start_line, end_line)
+        }
+        bases = node.child_by_field_name("superclasses")
+        if bases:
+            class_info["inherits"] = [
+                get_text(c) for c in bases.children if c.type == "identifier"
+            ]
+        classes[class_name] = class_info
+        return True, class_name
+
+    def handle_function(node, parent_class):
+        func_name = get_text(node.child_by_field_name("name"))
+        params = node.child_by_field_name("parameters")
+        start_line, end_line = get_lines(node)
+        param_list = []
+        if params:
+            for p in params.children:
+                if p.type == "identifier":
+                    param_list.append(get_text(p))
+        func_info = {
+            "params": param_list,
+            "lines": (start_line, end_line)
+        }
+        if parent_class:
+            classes[parent_class]["methods"][func_name] = func_info
+        else:
+            functions[func_name] = func_info
+        return False, parent_class
+
+    def handle_call(node, parent_class):
+        # Function call node
+        func_node = node.child_by_field_name("function")
+        if func_node:
+            func_name = get_text(func_node)
             start_line, end_line = get_lines(node)
-            param_list = []
-            if params:
-                for p in params.children:
-                    if p.type == "identifier":
-                        param_list.append(get_text(p))
-            func_info = {
-                "params": param_list,
+            function_calls.append({
+                "name": func_name,
                 "lines": (start_line, end_line)
-            }
-            if parent_class:
-                result["classes"][parent_class]["methods"][func_name] = func_info
+            })
+        return True, parent_class
+
+    handlers = {
+        "import_statement": handle_import,
+        "class_definition": handle_class,
+        "function_definition": handle_function,
+        "call": handle_call,
+    }
+
+    def walk(tree):
+        # Depth-first walk with a tree-sitter cursor; class_stack holds the
+        # enclosing class name for each depth the cursor has descended into.
+        cursor = tree.walk()
+        class_stack = [None]
+        while True:
+            node = cursor.node
+            parent_class = class_stack[-1]
+            handler = handlers.get(node.type)
+            if handler:
+                descend, child_class = handler(node, parent_class)
             else:
-                result["functions"][func_name] = func_info
-
-        elif node.type == "call":
-            # Function call node
-            func_node = node.child_by_field_name("function")
-            if func_node:
-                func_name = get_text(func_node)
-                start_line, end_line = get_lines(node)
-                result["function_calls"].append({
-                    "name": func_name,
-                    "lines": (start_line, end_line)
-                })
-            for child in node.children:
-                walk(child, parent_class)
+                descend, child_class = True, parent_class
 
-        else:
-            for child in node.children:
-                walk(child, parent_class)
+            if descend and cursor.goto_first_child():
+                class_stack.append(child_class)
+                continue
+            while not cursor.goto_next_sibling():
+                if not cursor.goto_parent():
+                    return
+                class_stack.pop()
 
-    walk(root_node)
+    walk(tree)
     return result
 
 
-def traverse_and_parse(structure: dict) -> dict:
-    """Traverse the folder structure and parse code files with Tree-sitter."""
+def _skipped(file_path: str, reason: str) -> dict:
+    """Analysis entry for a file that was not parsed."""
+    return {"file": file_path, "skipped": reason}
+
+
+def _parse_batch(task):
+    """Read and parse a batch of python files. Runs inside a worker."""
+    files, codebase_modules, max_file_size = task
+    results = []
+    for name, path in files:
+        if max_file_size is not None and os.path.getsize(path) > max_file_size:
+            results.append((name, _skipped(path, f"larger than {max_file_size} bytes")))
+            continue
+        # tree-sitter parses the raw bytes, so hand them over without a str round-trip
+        with open(path, "rb") as f:
+            code = f.read()
+        # NUL bytes never appear in python source; treat such files as binary
+        if b"\0" in code[:1024]:
+            results.append((name, _skipped(path, "binary file")))
+            continue
+        try:
+            result = parse_code(code, path, codebase_modules)
+        except (SyntaxError, UnicodeDecodeError) as e:
+            # bad coding cookie or bytes that do not match the declared
+            # encoding; record it rather than losing the whole analysis
+            result = _skipped(path, f"cannot decode source: {e}")
+        results.append((name, result))
+    return results
+
+
+def traverse_and_parse(structure: dict, backend: str = "thread", max_file_size: int | None = MAX_FILE_SIZE) -> dict:
+    """Traverse the folder structure and parse code files with Tree-sitter.
+
+    backend selects the worker pool. "thread" (default) stays in the current
+    interpreter; on standard CPython the GIL serializes parsing between
+    threads, so it only overlaps file reads there, while on free-threaded
+    CPython it scales across cores. "process" is opt-in and POSIX-only: it
+    forks the current process to parse on every core, so avoid it once other
+    threads (e.g. LLM clients) are running. Repos with fewer than
+    SERIAL_THRESHOLD files are parsed serially with either backend.
+
+    Files larger than max_file_size bytes (None lifts the limit), binary files
+    and files that cannot be decoded are not parsed; their analysis entry is
+    {"file": path, "skipped": reason} and the skip is printed.
+    """
+    if backend not in ("process", "thread"):
+        raise ValueError(f"Unknown backend {backend!r}, expected 'process' or 'thread'")
+    if backend == "process" and "fork" not in multiprocessing.get_all_start_methods():
+        raise ValueError("The 'process' backend needs the fork start method, which this platform lacks")
+
     analysis = {}
 
-    # Collect all module names in the codebase for import classification
-    def collect_modules(node, modules):
-        for name, child in node.items():
+    # Single pass over the structure: collect module names for import
+    # classification and the python files to parse. The explicit stack of
+    # item iterators keeps the depth-first order without recursing per folder.
+    codebase_modules = set()
+    py_files = []
+    stack = [iter(structure.items())]
+    while stack:
+        for name, child in stack[-1]:
             if isinstance(child, dict):
-                collect_modules(child, modules)
+                stack.append(iter(child.items()))
+                break
             elif isinstance(child, list) and name.endswith(".py"):
-                mod_name = os.path.splitext(name)[0]
-                modules.add(mod_name)
-    codebase_modules = set()
-    collect_modules(structure, codebase_modules)
+                codebase_modules.add(os.path.splitext(name)[0])
+                py_files.append((name, child[1]))
+        else:
+            stack.pop()
 
-    #traverse and parse the structure
-    def recurse(node):
-        for name, child in node.items():
-            if isinstance(child, dict): 
-                recurse(child)
-            elif isinstance(child, list) and name.endswith(".py"):
-                with open(child[1], "r", encoding="utf-8") as f:
-                    code = f.read()
-                analysis[name] = parse_code(code, child[1], codebase_modules)
-            else:
-                continue
-    recurse(structure)
+    if not py_files:
+        return analysis
+
+    def collect(results):
+        for name, result in results:
+            if "skipped" in result:
+                print(f"Skipping {result['file']}: {result['skipped']}")
+            analysis[name] = result
+
+    codebase_modules = frozenset(codebase_modules)
+    if len(py_files) < SERIAL_THRESHOLD:
+        collect(_parse_batch((py_files, codebase_modules, max_file_size)))
+        return analysis
+
+    #parse the collected files in the worker pool. Batches are sized so every
+    #worker gets several tasks (for load balancing), capped at BATCH_SIZE files
+    #to amortize the per-task IPC round-trip on large repos
+    workers = os.cpu_count() or 1
+    batch_size = max(1, min(BATCH_SIZE, math.ceil(len(py_files) / (workers * 4))))
+    tasks = [
+        (py_files[i:i + batch_size], codebase_modules, max_file_size)
+        for i in range(0, len(py_files), batch_size)
+    ]
+    # never start more workers than there are tasks
+    workers = min(workers, len(tasks))
+    if backend == "process":
+        # Fork explicitly: spawn and forkserver workers re-run __main__, which
+        # under `jac run` is main.jac and cannot be executed as python
+        executor = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("fork")
+        )
+    else:
+        executor = ThreadPoolExecutor(max_workers=workers)
+    with executor:
+        for results in executor.map(_parse_batch, tasks):
+            collect(results)
     return analysis
 
@@ -2,18 +2,25 @@ import re
 from pathlib import Path
 import os
 import base64
-import io, requests
-from PIL import Image as im
-import matplotlib.pyplot as plt
+import hashlib
+import tempfile
+import requests
+
+_WIN_PATH_RE = re.compile(r"^[a-zA-Z]:\\(?:[^\\/:*?\"<>|\r\n]+\\?)*$")
+_GH_RE = re.compile(r"^https://github\.com/[\w\-.]+/[\w\-.]+(\.git)?$")
+
+# Kept next to this module so the cache does not depend on where `jac run` is launched
+MERMAID_CACHE_DIR = Path(__file__).resolve().parent / ".mermaid_cache"
+
+# Shared session so repeated mermaid.ink requests reuse the TLS connection
+_SESSION = requests.Session()
 
 def is_path_valid_up_to_parent(path: str) -> bool:
     """
     Checks if all intermediate directories in the given path exist, 
     excluding the last folder (which can be created).
     """
-    pattern = r"^[a-zA-Z]:\\(?:[^\\/:*?\"<>|\r\n]+\\?)*$"
-
-    if  re.match(pattern, path):
+    if _WIN_PATH_RE.match(path):
         parent_path = Path(path).parent
         parent_path_exists = parent_path.exists() and parent_path.is_dir()
 
@@ -32,47 +39,68 @@ def validate_github_url(url):
     """
     Validates that the URL is a properly formatted GitHub repository URL.
     """
-    pattern = r"^https:\/\/github\.com\/[\w\-\.]+\/[\w\-\.]+(\.git)?$"
-    return re.match(pattern, url) is not None
+    return _GH_RE.match(url) is not None
 
-def dict_to_tree(structure: dict, indent: str = "") -> str:
-    """Convert the nested structure_dict into a folder tree string."""
-    tree_str = ""
+def _dict_to_tree_lines(structure: dict, indent: str, out: list) -> None:
+    """Append the folder tree lines of structure to out."""
     for i, (name, content) in enumerate(structure.items()):
         is_last = i == len(structure) - 1
         prefix = "└── " if is_last else "├── "
 
         if isinstance(content, dict):
             # Folder
-            tree_str += f"{indent}{prefix}{name}/\n"
+            out.append(f"{indent}{prefix}{name}/\n")
             # Recurse into subfolder
-            tree_str += dict_to_tree(content, indent + ("    " if is_last else "│   "))
+            _dict_to_tree_lines(content, indent + ("    " if is_last else "│   "), out)
         else:
             # File
-            tree_str += f"{indent}{prefix}{name}\n"
+            out.append(f"{indent}{prefix}{name}\n")
+
+def dict_to_tree(structure: dict, indent: str = "") -> str:
+    """Convert the nested structure_dict into a folder tree string."""
+    out = []
+    _dict_to_tree_lines(structure, indent, out)
+    return "".join(out)
+
+
+def _fetch_mermaid_png(base64_bytes: bytes) -> bytes:
+    """Fetch the rendered PNG for an encoded mermaid diagram, reusing a cached copy if present."""
+    # /img/ returns JPEG unless a PNG is asked for explicitly
+    url = 'https://mermaid.ink/img/' + base64_bytes.decode("ascii") + '?type=png'
+    # Key on the full URL so a change in render options never serves a stale format
+    cache_file = MERMAID_CACHE_DIR / f"{hashlib.sha256(url.encode('ascii')).hexdigest()}.png"
+    if cache_file.exists():
+        return cache_file.read_bytes()
+
+    response = _SESSION.get(url, timeout=60)
+    response.raise_for_status()
+    MERMAID_CACHE_DIR.mkdir(exist_ok=True)
+    # Write to a temp file and rename it into place so an interrupted write
+    # never leaves a truncated image in the cache
+    fd, tmp_path = tempfile.mkstemp(dir=MERMAID_CACHE_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(response.content)
+        os.replace(tmp_path, cache_file)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return response.content
 
-    return tree_str
 
+def _save_mermaid_png(structure: str, doc_path: str, file_name: str) -> None:
+    """Render a mermaid diagram through mermaid.ink and save it as <doc_path>/<file_name>.png."""
+    base64_bytes = base64.urlsafe_b64encode(structure.encode("utf8"))
+    # mermaid.ink renders the PNG itself (?type=png), so write the bytes as-is
+    Path(doc_path, f"{file_name}.png").write_bytes(_fetch_mermaid_png(base64_bytes))
 
 def generate_images_using_mermaid_diagrams(structure:str,doc_path:str,image_name:str) -> None:
     """Generate and save a mermaid diagram as an image file."""
-    graphbytes = structure.encode("utf8")
-    base64_bytes = base64.urlsafe_b64encode(graphbytes)
-    base64_string = base64_bytes.decode("ascii")
-    img = im.open(io.BytesIO(requests.get('https://mermaid.ink/img/' + base64_string).content))
-    plt.imshow(img)
-    plt.axis('off') # allow to hide axis
-    plt.savefig(f'{doc_path}/{image_name}.png', dpi=300, bbox_inches='tight')
+    _save_mermaid_png(structure, doc_path, image_name)
 
 def generate_code_structure_using_mermaid_diagrams(structure:str,doc_path:str,folder_name:str) -> None:
     """Generate and save a code_structure mermaid diagram as an image file."""
-    graphbytes = structure.encode("utf8")
-    base64_bytes = base64.urlsafe_b64encode(graphbytes)
-    base64_string = base64_bytes.decode("ascii")
-    img = im.open(io.BytesIO(requests.get('https://mermaid.ink/img/' + base64_string).content))
-    plt.imshow(img)
-    plt.axis('off') # allow to hide axis
-    plt.savefig(f'{doc_path}/{folder_name}.png', dpi=300, bbox_inches='tight')
+    _save_mermaid_png(structure, doc_path, folder_name)
 
 message = """
             As a supervisor agent your first task is to clone a github repository from provided {github_url} if first step is fulfiled if and only if then navigate to the next Agent using AgentType.